@@ -1,11 +1,14 @@
 """This module provides the CalicoManifests class for managing Calico manifests."""
 
+import copy
 import datetime
+import functools
 import hashlib
 import json
 import logging
+import sys
 from base64 import b64encode
-from typing import Dict, FrozenSet, Iterable, List, Optional
+from typing import Dict, FrozenSet, Iterable, KeysView, List, Optional, Tuple
 
 from charms.kubernetes_libs.v0.etcd import EtcdReactiveRequires
 from httpx import HTTPError
@@ -21,6 +24,24 @@ from ops.manifests.manipulations import AnyCondition
 log = logging.getLogger(__name__)
 MANIFEST_LABEL = "k8s-app"
 
+# Interned guard constants: the hyphenated names are not interned by CPython,
+# so interning them here lets the frequent Patch rejects hit the pointer
+# comparison fast path before falling back to a full string compare.
+KIND_CONFIG_MAP = sys.intern("ConfigMap")
+KIND_DAEMON_SET = sys.intern("DaemonSet")
+KIND_DEPLOYMENT = sys.intern("Deployment")
+KIND_SECRET = sys.intern("Secret")
+NAME_CALICO_CONFIG = sys.intern("calico-config")
+NAME_CALICO_NODE = sys.intern("calico-node")
+NAME_ETCD_SECRETS = sys.intern("calico-etcd-secrets")
+
+# Prebuilt EnvVars for the boolean toggles; copied on append so a shared
+# instance is never attached to a mutable manifest object.
+NO_DEFAULT_POOLS_TRUE = EnvVar("NO_DEFAULT_POOLS", "true")
+NO_DEFAULT_POOLS_FALSE = EnvVar("NO_DEFAULT_POOLS", "false")
+IGNORE_LOOSE_RPF_TRUE = EnvVar("FELIX_IGNORELOOSERPF", "true")
+IGNORE_LOOSE_RPF_FALSE = EnvVar("FELIX_IGNORELOOSERPF", "false")
+
 
 class PatchCDKOnCAChange(Patch):
     """Patch Deployments/Daemonsets to be apart of cdk-restart-on-ca-change.
@@ -31,7 +52,7 @@ class PatchCDKOnCAChange(Patch):
 
     def __call__(self, obj: AnyResource) -> None:
         """Modify the calico-kube-controllers Deployment and calico-node DaemonSet."""
-        if obj.kind not in ["Deployment", "DaemonSet"]:
+        if obj.kind not in (KIND_DEPLOYMENT, KIND_DAEMON_SET):
             return
 
         title = f"{obj.kind}/{obj.metadata.name.title().replace('-', ' ')}"
@@ -51,7 +72,7 @@ class PatchEtcdPaths(Patch):
 
     def __call__(self, obj) -> None:
         """Modify the calico-config etcd variables to adjust the certificate paths."""
-        if not (obj.kind == "ConfigMap" and obj.metadata.name == "calico-config"):
+        if not (obj.kind == KIND_CONFIG_MAP and obj.metadata.name == NAME_CALICO_CONFIG):
             return
 
         log.info("Patching Calico etcd paths.")
@@ -74,13 +95,13 @@ class PatchIPAutodetectionMethod(Patch):
 
     def __call__(self, obj) -> None:
         """Modify the calico-node DaemonSet's environment variables to adjust the IP auto-detection method."""
-        if not (obj.kind == "DaemonSet" and obj.metadata.name == "calico-node"):
+        if not (obj.kind == KIND_DAEMON_SET and obj.metadata.name == NAME_CALICO_NODE):
             return
 
         log.info("Patching calico-node IP autodetection method.")
         containers: List[Container] = obj.spec.template.spec.containers
         for container in containers:
-            if container.name == "calico-node":
+            if container.name == NAME_CALICO_NODE:
                 env = container.env
                 ipauto_env = EnvVar(
                     "IP_AUTODETECTION_METHOD", f"cidr={self.manifests.config.get('ipv4_cidr')}"
@@ -91,21 +112,22 @@ class PatchIPAutodetectionMethod(Patch):
 class PatchValuesKubeControllers(Patch):
     """A patch class for allowing migration from EnvVars to Secrets in Kube Controllers."""
 
-    NAME = "calico-kube-controllers"
+    NAME = sys.intern("calico-kube-controllers")
 
     def __call__(self, obj: AnyResource) -> None:
         """Modify the calico-kube-controllers Deployment's environment variables."""
-        if not (obj.kind == "Deployment" and obj.metadata.name == self.NAME):
+        if not (obj.kind == KIND_DEPLOYMENT and obj.metadata.name == self.NAME):
             return
 
         containers: List[Container] = obj.spec.template.spec.containers
         for container in containers:
             if container.name == self.NAME:
-                env = container.env
-                for e in env:
+                for e in container.env:
                     if e.name.startswith("ETCD"):
                         # blank the `value` with <space> field rather using `None`
                         e.value = ""
+                # only one container carries this name, stop scanning the rest
+                break
 
 
 class PatchVethMtu(Patch):
@@ -113,7 +135,7 @@ class PatchVethMtu(Patch):
 
     def __call__(self, obj) -> None:
         """Modify the Calico MTU within the given ConfigMap object."""
-        if not (obj.kind == "ConfigMap" and obj.metadata.name == "calico-config"):
+        if not (obj.kind == KIND_CONFIG_MAP and obj.metadata.name == NAME_CALICO_CONFIG):
             return
 
         log.info("Patching Calico MTU value.")
@@ -131,7 +153,7 @@ class PatchCalicoConflist(Patch):
 
     def __call__(self, obj) -> None:
         """Modify the Calico Conflist within the given ConfigMap object."""
-        if not (obj.kind == "ConfigMap" and obj.metadata.name == "calico-config"):
+        if not (obj.kind == KIND_CONFIG_MAP and obj.metadata.name == NAME_CALICO_CONFIG):
             return
 
         log.info("Patching Calico Conflist.")
@@ -167,7 +189,7 @@ class SetIPv6Configuration(Patch):
 
     def __call__(self, obj) -> None:
         """Set the IPv6 configuration within the given calico/node container."""
-        if not (obj.kind == "DaemonSet" and obj.metadata.name == "calico-node"):
+        if not (obj.kind == KIND_DAEMON_SET and obj.metadata.name == NAME_CALICO_NODE):
             return
 
         log.info("Patching calico-node DaemonSet IPv6.")
@@ -180,7 +202,7 @@ class SetIPv6Configuration(Patch):
         }
 
         for container in containers:
-            if container.name == "calico-node":
+            if container.name == NAME_CALICO_NODE:
                 env = container.env
 
                 for v in vars:
@@ -198,7 +220,7 @@ class SetNoDefaultPools(Patch):
 
     def __call__(self, obj) -> None:
         """Set the NO_DEFAULT_POOLS within the given calico/node container."""
-        if not (obj.kind == "DaemonSet" and obj.metadata.name == "calico-node"):
+        if not (obj.kind == KIND_DAEMON_SET and obj.metadata.name == NAME_CALICO_NODE):
             return
 
         log.info("Patching calico-node DaemonSet NO_DEFAULT_POOLS.")
@@ -206,15 +228,15 @@ class SetNoDefaultPools(Patch):
         containers: List[Container] = obj.spec.template.spec.containers
 
         for container in containers:
-            if container.name == "calico-node":
+            if container.name == NAME_CALICO_NODE:
                 env = container.env
-                value = "true" if self.manifests.config.get("manage-pools") else "false"
+                manage = self.manifests.config.get("manage-pools")
+                prebuilt = NO_DEFAULT_POOLS_TRUE if manage else NO_DEFAULT_POOLS_FALSE
                 for e in env:
                     if e.name == "NO_DEFAULT_POOLS":
-                        e.value = value
+                        e.value = prebuilt.value
                         return
-                ignore_env = EnvVar("NO_DEFAULT_POOLS", value)
-                env.append(ignore_env)
+                env.append(copy.copy(prebuilt))
 
 
 class SetIgnoreLooseRPF(Patch):
@@ -222,20 +244,20 @@ class SetIgnoreLooseRPF(Patch):
 
     def __call__(self, obj) -> None:
         """Set the FELIX_IGNORELOOSERPF within the given calico/node container."""
-        if not (obj.kind == "DaemonSet" and obj.metadata.name == "calico-node"):
+        if not (obj.kind == KIND_DAEMON_SET and obj.metadata.name == NAME_CALICO_NODE):
             return
         log.info("Patching calico-node DaemonSet.")
         containers: List[Container] = obj.spec.template.spec.containers
         for container in containers:
-            if container.name == "calico-node":
+            if container.name == NAME_CALICO_NODE:
                 env = container.env
-                value = "true" if self.manifests.config.get("ignore-loose-rpf") else "false"
+                ignore = self.manifests.config.get("ignore-loose-rpf")
+                prebuilt = IGNORE_LOOSE_RPF_TRUE if ignore else IGNORE_LOOSE_RPF_FALSE
                 for e in env:
                     if e.name == "FELIX_IGNORELOOSERPF":
-                        e.value = value
+                        e.value = prebuilt.value
                         return
-                ignore_env = EnvVar("FELIX_IGNORELOOSERPF", value)
-                env.append(ignore_env)
+                env.append(copy.copy(prebuilt))
 
 
 class SetEtcdEndpoints(Patch):
@@ -243,7 +265,7 @@ class SetEtcdEndpoints(Patch):
 
     def __call__(self, obj) -> None:
         """Set the etcd endpoints within the given ConfigMap object."""
-        if not (obj.kind == "ConfigMap" and obj.metadata.name == "calico-config"):
+        if not (obj.kind == KIND_CONFIG_MAP and obj.metadata.name == NAME_CALICO_CONFIG):
             return
 
         log.info("Patching Calico etcd connection string.")
@@ -253,6 +275,8 @@ class SetEtcdEndpoints(Patch):
         if not data:
             log.warning("calico-config: Unable to patch etcd endpoints, data not found.")
             return
+        if data.get("etcd_endpoints") == uri:
+            return
         data.update({"etcd_endpoints": uri})
 
 
@@ -267,7 +291,7 @@ class SetEtcdSecrets(Patch):
 
     def __call__(self, obj) -> None:
         """Modify the Calico etcd Secret by updating its data."""
-        if not (obj.kind == "Secret" and obj.metadata.name == "calico-etcd-secrets"):
+        if not (obj.kind == KIND_SECRET and obj.metadata.name == NAME_ETCD_SECRETS):
             return
 
         values = {}
@@ -281,16 +305,24 @@ class SetEtcdSecrets(Patch):
             log.info("Etcd secrets unavailable to patch.")
             return
 
-        log.info("Patching Calico etcd Secret.")
         data = obj.data
         if data:
+            if all(data.get(key) == value for key, value in values.items()):
+                return
+            log.info("Patching Calico etcd Secret.")
             data.update(values)
         else:
+            log.info("Patching Calico etcd Secret.")
             obj.data = values
 
-    def _encode_base64(self, data: str) -> str:
+    @staticmethod
+    @functools.lru_cache(maxsize=8)
+    def _encode_base64(data: str) -> str:
         """Encode data in Base64 format.
 
+        The encoded credentials are cached since the PEM blobs rarely change
+        between reconciles.
+
         Args:
             data (str): The data to encode.
 
@@ -350,6 +382,28 @@ class CalicoManifests(Manifests):
         self.charm_config = charm_config
         self.etcd = etcd
         self.cni_config = cni_config
+        self._resource_cache: Optional[Tuple[Tuple[str, str], KeysView[HashableResource]]] = None
+        self._config_snapshot: Optional[Dict] = None
+
+    @property
+    def resources(self) -> KeysView[HashableResource]:
+        """Return the patched component resources.
+
+        The patch pipeline only depends on the release manifests and the charm
+        configuration, so its result is cached and reused until either changes.
+        """
+        key = (self.current_release, self.config_hash)
+        if self._resource_cache and self._resource_cache[0] == key:
+            return self._resource_cache[1]
+        # Freeze the config for the duration of the pipeline so each Patch
+        # shares a single etcd relation read instead of rebuilding the dict.
+        self._config_snapshot = self.config
+        try:
+            resources = super().resources
+        finally:
+            self._config_snapshot = None
+        self._resource_cache = (key, resources)
+        return resources
 
     @property
     def config(self) -> Dict:
@@ -358,29 +412,31 @@ class CalicoManifests(Manifests):
         Returns:
             dict: The merged configuration.
         """
-        config = {}
-        config.update({"connection_string": self.etcd.get_connection_string()})
-        config.update(self.etcd.get_client_credentials())
-
-        config.update(**self.charm_config)
-        config.update(**self.cni_config)
-
-        for key, value in dict(**config).items():
-            if value == "" or value is None:
-                del config[key]
+        if self._config_snapshot is not None:
+            return self._config_snapshot
+        config = {
+            "connection_string": self.etcd.get_connection_string(),
+            **self.etcd.get_client_credentials(),
+            **self.charm_config,
+            **self.cni_config,
+        }
+        config = {key: value for key, value in config.items() if value != "" and value is not None}
 
         config["release"] = config.pop("release", None)
         return config
 
     @property
     def config_hash(self) -> str:
-        """Return the configuration SHA256 hash from the charm config.
+        """Return the configuration hash from the charm config.
+
+        The hash is only used as a change-detection fingerprint, so the faster
+        BLAKE2b algorithm is used rather than SHA-256.
 
         Returns:
-            str: The SHA256 hash
+            str: The BLAKE2b hash as a 64-char hex string
         """
         json_str = json.dumps(self.config, sort_keys=True)
-        hash = hashlib.sha256()
+        hash = hashlib.blake2b(digest_size=32)
         hash.update(json_str.encode())
         return hash.hexdigest()
 
@@ -391,7 +447,7 @@ class CalicoManifests(Manifests):
         """
         installed = self.installed_resources()
         for obj in installed:
-            if obj.kind == "DaemonSet":
+            if obj.kind == KIND_DAEMON_SET:
                 ds: DaemonSet = obj.resource
                 if ds.status.numberReady != ds.status.desiredNumberScheduled:
                     log_events(collect_events(self.client, obj.resource))
@@ -3,17 +3,21 @@
 
 """Charm the service."""
 
+import functools
+import hashlib
 import ipaddress
+import json
 import logging
 import os
 import shutil
 import subprocess
-import tarfile
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from socket import gethostname
 from subprocess import CalledProcessError, TimeoutExpired
-from typing import Set
+from typing import Optional, Set
 
 import ops
 import yaml
@@ -26,6 +30,11 @@ from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus, ModelError
 
 from calico_manifests import CalicoManifests
 
+try:  # libyaml bindings are substantially faster when available
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:  # pragma: nocover
+    from yaml import SafeLoader as YamlLoader
+
 log = logging.getLogger(__name__)
 
 VALID_LOG_LEVELS = ["info", "debug", "warning", "error", "critical"]
@@ -58,6 +67,9 @@ class CalicoCharm(ops.CharmBase):
         super().__init__(*args)
         self.etcd = EtcdReactiveRequires(self)
         self.cni_config = {}
+        self._yaml_cache = {}
+        self._bind_address = None
+        self._rpf_cache = None
         self.stored.set_default(
             binaries_installed=False,
             calico_configured=False,
@@ -66,9 +78,12 @@ class CalicoCharm(ops.CharmBase):
             cni_configured=False,
             ncp_deployed=False,
             deployed=False,
+            bgp_globals_hash="",
+            bgp_peer_hash="",
+            pool_config_hash="",
         )
-        self.calico_manifests = CalicoManifests(self, self.config, self.etcd, self.cni_config)
-        self.collector = Collector(self.calico_manifests)
+        self._calico_manifests = None
+        self._collector = None
 
         self.framework.observe(self.on.install, self._on_install)
         self.framework.observe(self.on.upgrade_charm, self._on_upgrade)
@@ -84,8 +99,32 @@ class CalicoCharm(ops.CharmBase):
         self.framework.observe(self.on.scrub_resources_action, self._scrub_resources)
         self.framework.observe(self.on.sync_resources_action, self._sync_resources)
 
+    @property
+    def calico_manifests(self) -> CalicoManifests:
+        """The Calico manifests, constructed on first use.
+
+        Hooks which never touch the manifests (e.g. update-status) skip the
+        construction cost entirely.
+        """
+        if self._calico_manifests is None:
+            self._calico_manifests = CalicoManifests(self, self.config, self.etcd, self.cni_config)
+        return self._calico_manifests
+
+    @property
+    def collector(self) -> Collector:
+        """The manifest collector, constructed on first use."""
+        if self._collector is None:
+            self._collector = Collector(self.calico_manifests)
+        return self._collector
+
     def _on_etcd_changed(self, event):
         self.etcd.save_client_credentials(ETCD_CA_PATH, ETCD_CERT_PATH, ETCD_KEY_PATH)
+        self.__dict__.pop("_calicoctl_subprocess_env", None)
+        # a new datastore knows nothing of the config we applied to the old
+        # one; drop the change-gates so every step re-applies
+        self.stored.bgp_globals_hash = ""
+        self.stored.bgp_peer_hash = ""
+        self.stored.pool_config_hash = ""
         self.unit.status = MaintenanceStatus("Updating etcd configuration.")
         if self.stored.deployed:
             try:
@@ -122,10 +161,23 @@ class CalicoCharm(ops.CharmBase):
 
     def _configure_calico(self):
         try:
-            self._configure_calico_pool()
-            self._configure_node()
-            self._configure_bgp_globals()
-            self._configure_bgp_peers()
+            # The pool, node and BGP steps touch independent Calico resources
+            # and block on calicoctl I/O, so they can run concurrently; a
+            # single status write here avoids the steps racing over
+            # unit.status from the pool threads.
+            self.unit.status = MaintenanceStatus("Configuring Calico.")
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                futures = [
+                    executor.submit(task)
+                    for task in (
+                        self._configure_calico_pool,
+                        self._configure_node,
+                        self._configure_bgp_globals,
+                        self._configure_bgp_peers,
+                    )
+                ]
+                for future in futures:
+                    future.result()
             self._disable_vxlan_tx_checksumming()
             self.stored.calico_configured = True
         except yaml.YAMLError as e:
@@ -256,31 +308,28 @@ class CalicoCharm(ops.CharmBase):
         return {net.version for net in self._get_networks(self.config["cidr"])}
 
     def _configure_bgp_globals(self):
-        self.unit.status = MaintenanceStatus("Configuring BGP globals.")
+        fingerprint = self._config_fingerprint(
+            "global-as-number",
+            "node-to-node-mesh",
+            "bgp-service-cluster-ips",
+            "bgp-service-external-ips",
+            "bgp-service-loadbalancer-ips",
+        )
+        if fingerprint == self.stored.bgp_globals_hash:
+            log.info("BGP globals are unchanged, skipping.")
+            return
 
-        try:
-            bgp_config = self._calicoctl_get("bgpconfig", "default")
-        except (CalledProcessError, TimeoutExpired) as e:
-            if b"resource does not exist" in e.stderr:
-                log.warning("default BGPConfiguration does not exist.")
-                bgp_config = {
-                    "apiVersion": "projectcalico.org/v3",
-                    "kind": "BGPConfiguration",
-                    "metadata": {"name": "default"},
-                    "spec": {},
-                }
-            else:
-                log.exception("Failed to get BGPConfiguration")
-                raise e
+        log.info("Configuring BGP globals.")
 
         ip_mapping = {
             "bgp-service-cluster-ips": "serviceClusterIPs",
             "bgp-service-external-ips": "serviceExternalIPs",
             "bgp-service-loadbalancer-ips": "serviceLoadBalancerIPs",
         }
-        spec = bgp_config["spec"]
-        spec["asNumber"] = self.config["global-as-number"]
-        spec["nodeToNodeMeshEnabled"] = self.config["node-to-node-mesh"]
+        spec = {
+            "asNumber": self.config["global-as-number"],
+            "nodeToNodeMeshEnabled": self.config["node-to-node-mesh"],
+        }
         spec.update(
             {
                 ip_mapping[key]: [{"cidr": cidr} for cidr in self.config[key].split()]
@@ -288,41 +337,73 @@ class CalicoCharm(ops.CharmBase):
             }
         )
         try:
-            self._calicoctl_apply(bgp_config)
+            # patch sends only the delta, avoiding the get/modify/apply round-trip
+            self._calicoctl_patch("bgpconfig", "default", {"spec": spec})
             log.info("Configured BGP globals.")
         except (CalledProcessError, TimeoutExpired) as e:
-            log.exception("Failed to apply BGPConfiguration")
-            raise e
+            if not (isinstance(e, CalledProcessError) and b"resource does not exist" in e.stderr):
+                log.exception("Failed to apply BGPConfiguration")
+                raise e
+            log.warning("default BGPConfiguration does not exist.")
+            bgp_config = {
+                "apiVersion": "projectcalico.org/v3",
+                "kind": "BGPConfiguration",
+                "metadata": {"name": "default"},
+                "spec": spec,
+            }
+            try:
+                self._calicoctl_apply(bgp_config)
+                log.info("Configured BGP globals.")
+            except (CalledProcessError, TimeoutExpired) as e:
+                log.exception("Failed to apply BGPConfiguration")
+                raise e
+        self.stored.bgp_globals_hash = fingerprint
 
     def _configure_node(self):
-        self.unit.status = MaintenanceStatus("Configuring Calico node.")
+        log.info("Configuring Calico node.")
 
-        node_name = gethostname()
+        node_name = self.hostname
         as_number = self._get_unit_as_number()
         route_reflector_cluster_id = self._get_route_reflector_cluster_id()
 
+        patch = {
+            "spec": {
+                "bgp": {
+                    "asNumber": as_number,
+                    "routeReflectorClusterID": route_reflector_cluster_id,
+                }
+            }
+        }
         try:
-            node = self._calicoctl_get("node", node_name)
-            node["spec"]["bgp"]["asNumber"] = as_number
-            node["spec"]["bgp"]["routeReflectorClusterID"] = route_reflector_cluster_id
-            self._calicoctl_apply(node)
+            self._calicoctl_patch("node", node_name, patch)
             log.info("Configured Calico node.")
         except (CalledProcessError, TimeoutExpired) as e:
             log.exception("Failed to configure node.")
             raise e
 
+    def _list_bgp_peer_names(self) -> Set[str]:
+        """Return the names of all existing BGP peers.
+
+        A go-template projection keeps the transfer down to just the names
+        rather than the full spec of every peer.
+        """
+        output = self.calicoctl(
+            "get", "bgppeers", "-o", "go-template={{range .items}}{{.metadata.name}} {{end}}"
+        )
+        return set(output.decode().split())
+
     def _get_route_reflector_cluster_id(self):
-        route_reflector_cluster_ids = yaml.safe_load(self.config["route-reflector-cluster-ids"])
+        route_reflector_cluster_ids = self._yaml_config("route-reflector-cluster-ids")
         unit_id = self._get_unit_id()
         return route_reflector_cluster_ids.get(unit_id)
 
     def _get_unit_as_number(self):
         unit_id = self._get_unit_id()
-        unit_as_numbers = yaml.safe_load(self.config["unit-as-numbers"])
+        unit_as_numbers = self._yaml_config("unit-as-numbers")
         if unit_id in unit_as_numbers:
             return unit_as_numbers[unit_id]
 
-        subnet_as_numbers = yaml.safe_load(self.config["subnet-as-numbers"])
+        subnet_as_numbers = self._yaml_config("subnet-as-numbers")
         subnets = self._filter_local_subnets(subnet_as_numbers)
         if subnets:
             subnets.sort(key=lambda subnet: -subnet.prefixlen)
@@ -334,30 +415,34 @@ class CalicoCharm(ops.CharmBase):
 
     def _filter_local_subnets(self, subnets):
         bind_address = ipaddress.ip_address(self._get_bind_address())
-        filtered_subnets = [
-            ipaddress.ip_network(subnet)
-            for subnet in subnets
-            if bind_address in ipaddress.ip_network(subnet)
-        ]
-        return filtered_subnets
+        networks = (ipaddress.ip_network(subnet) for subnet in subnets)
+        return [network for network in networks if bind_address in network]
 
     def _get_bind_address(self):
-        bind_address = self.model.get_binding("cni").network.bind_address
-        return bind_address
+        if self._bind_address is None:
+            self._bind_address = self.model.get_binding("cni").network.bind_address
+        return self._bind_address
 
     def _configure_bgp_peers(self):
-        self.unit.status = MaintenanceStatus("Configuring BGP peers.")
+        fingerprint = self._config_fingerprint(
+            "global-bgp-peers", "subnet-bgp-peers", "unit-bgp-peers"
+        )
+        if fingerprint == self.stored.bgp_peer_hash:
+            log.info("BGP peer config is unchanged, skipping.")
+            return
+
+        log.info("Configuring BGP peers.")
 
         peers = []
-        peers += yaml.safe_load(self.config["global-bgp-peers"])
+        peers += self._yaml_config("global-bgp-peers")
 
-        subnet_bgp_peers = yaml.safe_load(self.config["subnet-bgp-peers"])
+        subnet_bgp_peers = self._yaml_config("subnet-bgp-peers")
         subnets = self._filter_local_subnets(subnet_bgp_peers)
         for subnet in subnets:
             peers += subnet_bgp_peers.get(str(subnet), [])
 
         unit_id = self._get_unit_id()
-        unit_bgp_peers = yaml.safe_load(self.config["unit-bgp-peers"])
+        unit_bgp_peers = self._yaml_config("unit-bgp-peers")
         if unit_id in unit_bgp_peers:
             peers += unit_bgp_peers[unit_id]
 
@@ -368,9 +453,9 @@ class CalicoCharm(ops.CharmBase):
         }
 
         try:
-            node_name = gethostname()
-            for peer_name, peer in named_peers.items():
-                peer_def = {
+            node_name = self.hostname
+            peer_defs = [
+                {
                     "apiVersion": "projectcalico.org/v3",
                     "kind": "BGPPeer",
                     "metadata": {
@@ -382,20 +467,24 @@ class CalicoCharm(ops.CharmBase):
                         "asNumber": peer["as-number"],
                     },
                 }
-                self._calicoctl_apply(peer_def)
+                for peer_name, peer in named_peers.items()
+            ]
+            if peer_defs:
+                self._calicoctl_apply_many(peer_defs)
 
             log.info("Removing unrecognized peers.")
-            existing_peers = self._calicoctl_get("bgppeers")["items"]
-            existing_peers = [peer["metadata"]["name"] for peer in existing_peers]
+            prefix = safe_unit_name + "-"
+            existing_names = self._list_bgp_peer_names()
             peers_to_delete = [
-                peer
-                for peer in existing_peers
-                if peer.startswith(safe_unit_name + "-") and peer not in named_peers
+                name
+                for name in existing_names
+                if name.startswith(prefix) and name not in named_peers
             ]
 
-            for peer in peers_to_delete:
-                self.calicoctl("delete", "bgppeer", peer)
+            if peers_to_delete:
+                self.calicoctl("delete", "bgppeer", *peers_to_delete, "--skip-not-exists")
             log.info("Configured BGP peers.")
+            self.stored.bgp_peer_hash = fingerprint
         except (CalledProcessError, TimeoutExpired) as e:
             log.exception("Failed to apply BGP peer configuration.")
             raise e
@@ -403,6 +492,28 @@ class CalicoCharm(ops.CharmBase):
     def _get_unit_id(self):
         return int(self.unit.name.split("/")[1])
 
+    def _config_fingerprint(self, *keys) -> str:
+        """Return a short fingerprint of the given config values.
+
+        Used to gate expensive calicoctl reconfiguration on actual change.
+        """
+        joined = "|".join(str(self.config[key]) for key in keys)
+        return hashlib.blake2b(joined.encode(), digest_size=16).hexdigest()
+
+    def _yaml_config(self, key: str):
+        """Parse a YAML config value, caching the result per source text.
+
+        Several handlers parse the same config values in one event; the cache
+        collapses those repeated parses to one per unique value.
+        """
+        text = self.config[key]
+        cached = self._yaml_cache.get(key)
+        if cached is not None and cached[0] == text:
+            return cached[1]
+        value = yaml.load(text, Loader=YamlLoader)
+        self._yaml_cache[key] = (text, value)
+        return value
+
     def _configure_cni(self):
         """Configure calico cni."""
         self.unit.status = MaintenanceStatus("Configuring Calico CNI.")
@@ -451,25 +562,33 @@ class CalicoCharm(ops.CharmBase):
             log.info("Skipping pool configuration.")
             return
 
-        self.unit.status = MaintenanceStatus("Configuring Calico IP pool.")
+        fingerprint = self._config_fingerprint("cidr", "ipip", "vxlan", "nat-outgoing")
+        if fingerprint == self.stored.pool_config_hash:
+            log.info("IP pool config is unchanged, skipping.")
+            return
+
+        log.info("Configuring Calico IP pool.")
 
         try:
             pools = self._calicoctl_get("pool")["items"]
 
-            cidrs = tuple(cidr.strip() for cidr in self.config["cidr"].split(","))
-            names = tuple(f"ipv{self._get_network(cidr).version}" for cidr in cidrs)
+            cidrs = [cidr.strip() for cidr in self.config["cidr"].split(",")]
+            networks = [self._get_network(cidr) for cidr in cidrs]
+            names = [f"ipv{network.version}" for network in networks]
+            cidr_set = set(cidrs)
+            name_set = set(names)
             pool_names_to_delete = [
                 pool["metadata"]["name"]
                 for pool in pools
-                if pool["metadata"]["name"] not in names or pool["spec"]["cidr"] not in cidrs
+                if pool["metadata"]["name"] not in name_set or pool["spec"]["cidr"] not in cidr_set
             ]
 
-            for pool_name in pool_names_to_delete:
-                log.info(f"Deleting Pool: {pool_name}")
-                self.calicoctl("delete", "pool", pool_name, "--skip-not-exists")
+            if pool_names_to_delete:
+                log.info(f"Deleting Pools: {', '.join(pool_names_to_delete)}")
+                self.calicoctl("delete", "pool", *pool_names_to_delete, "--skip-not-exists")
 
-            for cidr, name in zip(cidrs, names):
-                pool = {
+            pool_defs = [
+                {
                     "apiVersion": "projectcalico.org/v3",
                     "kind": "IPPool",
                     "metadata": {"name": name},
@@ -480,9 +599,12 @@ class CalicoCharm(ops.CharmBase):
                         "natOutgoing": self.config["nat-outgoing"],
                     },
                 }
-
-                self._calicoctl_apply(pool)
+                for cidr, name in zip(cidrs, names)
+            ]
+            if pool_defs:
+                self._calicoctl_apply_many(pool_defs)
             log.info("Configured Calico IP pool.")
+            self.stored.pool_config_hash = fingerprint
 
         except (CalledProcessError, TimeoutExpired) as e:
             log.exception("Failed to modify IP Pools.")
@@ -492,7 +614,7 @@ class CalicoCharm(ops.CharmBase):
         self._set_status()
 
     def _install_calico_binaries(self):
-        arch = self._get_arch()
+        arch = self.arch
         resource_name = "calico" if arch == "amd64" else f"calico-{arch}"
 
         try:
@@ -506,8 +628,8 @@ class CalicoCharm(ops.CharmBase):
             log.exception(f"Resource {resource_name} not found")
             return
 
-        filesize = os.stat(resource_path).st_size
-        if filesize < 1000000:
+        st = os.stat(resource_path)
+        if st.st_size < 1000000:
             self.unit.status = BlockedStatus(f"Incomplete resource: {resource_name}")
             return
 
@@ -533,6 +655,7 @@ class CalicoCharm(ops.CharmBase):
         self.stored.binaries_installed = True
 
     def _update_calicoctl_env(self, _):
+        self.__dict__.pop("_calicoctl_subprocess_env", None)
         env = self._get_calicoctl_env()
         lines = [f"export {key}={value}" for key, value in sorted(env.items())]
         output = "\n".join(lines)
@@ -541,6 +664,13 @@ class CalicoCharm(ops.CharmBase):
         with calicoctl_env.open("w") as f:
             f.write(output)
 
+    @functools.cached_property
+    def _calicoctl_subprocess_env(self) -> dict:
+        """Environment for calicoctl invocations, cached until etcd changes."""
+        env = os.environ.copy()
+        env.update(self._get_calicoctl_env())
+        return env
+
     def _get_calicoctl_env(self):
         env = {}
         env["ETCD_ENDPOINTS"] = self.etcd.get_connection_string()
@@ -550,9 +680,8 @@ class CalicoCharm(ops.CharmBase):
         return env
 
     def _unpack_archive(self, path: Path, destination: Path):
-        tar = tarfile.open(path)
-        tar.extractall(destination)
-        tar.close()
+        # system tar is considerably faster than the pure-Python tarfile module
+        subprocess.check_call(["tar", "-xf", str(path), "-C", str(destination)])
 
     def _list_versions(self, event):
         self.collector.list_versions(event)
@@ -575,11 +704,13 @@ class CalicoCharm(ops.CharmBase):
         else:
             self.stored.deployed = True
 
-    def _get_arch(self) -> str:
+    @functools.cached_property
+    def arch(self) -> str:
         """Retrieve the machine architecture as a string.
 
         This method uses the `dpkg` command to retrieve the machine architecture
-        of the current system. The architecture is returned as a string.
+        of the current system. The result is cached since it cannot change for
+        the lifetime of the process.
 
         Returns:
             str: The machine architecture as a string.
@@ -588,9 +719,18 @@ class CalicoCharm(ops.CharmBase):
         architecture = architecture.decode("utf-8")
         return architecture
 
-    def _get_network(self, cidr: str):
+    @functools.cached_property
+    def hostname(self) -> str:
+        """Hostname of the machine, cached for the lifetime of the process."""
+        return gethostname()
+
+    @staticmethod
+    @functools.lru_cache(maxsize=32)
+    def _get_network(cidr: str):
         """Retrieve the network address from a given CIDR.
 
+        Parsing is pure string work, so results are memoized across calls.
+
         Args:
             cidr (str): The CIDR (Classless Inter-Domain Routing) notation specifying the IP address range.
 
@@ -600,7 +740,7 @@ class CalicoCharm(ops.CharmBase):
         Example:
             get_network('192.168.0.0/24') returns IPv4Network('192.168.0.0/24')
         """
-        return ipaddress.ip_interface(address=cidr).network
+        return ipaddress.ip_network(cidr, strict=False)
 
     def _get_networks(self, cidrs: str):
         """Retrieve a list of network addresses from a comma-separated string of CIDRs.
@@ -617,8 +757,18 @@ class CalicoCharm(ops.CharmBase):
         return [self._get_network(cidr) for cidr in cidrs.split(",")]
 
     def _is_rpf_config_mismatched(self):
-        with open("/proc/sys/net/ipv4/conf/all/rp_filter") as f:
-            rp_filter = int(f.read())
+        # status updates are defensive, so a slightly stale value is fine
+        now = time.monotonic()
+        if self._rpf_cache and now - self._rpf_cache[0] < 30:
+            rp_filter = self._rpf_cache[1]
+        else:
+            # read procfs directly, skipping the buffered text-IO stack
+            fd = os.open("/proc/sys/net/ipv4/conf/all/rp_filter", os.O_RDONLY)
+            try:
+                rp_filter = int(os.read(fd, 8))
+            finally:
+                os.close(fd)
+            self._rpf_cache = (now, rp_filter)
         ignore_loose_rpf = self.config.get("ignore-loose-rpf")
         if rp_filter == 2 and not ignore_loose_rpf:
             # calico says this is invalid
@@ -626,17 +776,19 @@ class CalicoCharm(ops.CharmBase):
             return True
         return False
 
-    def calicoctl(self, *args, timeout: int = 60):
+    def calicoctl(self, *args, timeout: int = 60, input: Optional[bytes] = None):
         """Call calicoctl with specified args.
 
         @param int timeout: If the process does not terminate after timeout seconds,
                             raise a TimeoutExpired exception
+        @param bytes input: Optional data piped to calicoctl on stdin
         """
         cmd = ["/opt/calicoctl/calicoctl", "--log-level=debug"] + list(args)
-        env = os.environ.copy()
-        env.update(self._get_calicoctl_env())
+        env = self._calicoctl_subprocess_env
         try:
-            return subprocess.check_output(cmd, env=env, stderr=subprocess.PIPE, timeout=timeout)
+            return subprocess.check_output(
+                cmd, env=env, stderr=subprocess.PIPE, timeout=timeout, input=input
+            )
         except (CalledProcessError, TimeoutExpired) as e:
             log.error("env=%s", env)
             log.error("out=%s", e.stdout.decode())
@@ -644,21 +796,33 @@ class CalicoCharm(ops.CharmBase):
             raise
 
     def _calicoctl_get(self, *args):
-        args = ["get", "-o", "yaml", "--export"] + list(args)
+        # JSON output parses an order of magnitude faster than YAML
+        args = ["get", "-o", "json", "--export"] + list(args)
         output = self.calicoctl(*args)
         try:
-            result = yaml.safe_load(output)
-        except yaml.YAMLError:
-            log.exception(f"Failed to parse calicoctl output as yaml:\n {output}")
+            result = json.loads(output)
+        except json.JSONDecodeError:
+            log.exception(f"Failed to parse calicoctl output as json:\n {output}")
             raise
         return result
 
     def _calicoctl_apply(self, data):
-        with tempfile.TemporaryDirectory() as tmp:
-            filename = os.path.join(tmp, "calicoctl_manifest.yaml")
-            with open(filename, "w") as f:
-                yaml.dump(data, f)
-            self.calicoctl("apply", "-f", filename)
+        # calicoctl accepts JSON manifests; json.dumps is much cheaper than
+        # the PyYAML emitter for these small fixed-schema dicts.
+        self.calicoctl("apply", "-f", "-", input=json.dumps(data).encode())
+
+    def _calicoctl_patch(self, kind: str, name: str, patch: dict):
+        """Merge-patch a single calico resource with only the changed fields."""
+        self.calicoctl("patch", kind, name, "--patch", json.dumps(patch), "--type=merge")
+
+    def _calicoctl_apply_many(self, objects):
+        """Apply multiple objects with a single calicoctl invocation.
+
+        Piping the objects as one multi-document stream amortizes the
+        process spawn and etcd handshake across all of them.
+        """
+        stream = b"\n---\n".join(json.dumps(obj).encode() for obj in objects)
+        self.calicoctl("apply", "-f", "-", input=stream)
 
 
 if __name__ == "__main__":  # pragma: nocover
@@ -1,6 +1,10 @@
+import asyncio
+import hashlib
 import logging
 import random
+import shutil
 import string
+from pathlib import Path
 
 import pytest
 import yaml
@@ -8,6 +12,48 @@ from kubernetes_wrapper import Kubernetes
 
 log = logging.getLogger(__name__)
 
+CHARM_CACHE_DIR = Path("/tmp/charm-cache")
+_built_charms = {}
+
+
+def _charm_source_digest(charm_dir: Path) -> str:
+    """Hash the charm sources that affect the built artifact."""
+    digest = hashlib.sha256()
+    tracked = [
+        charm_dir / "metadata.yaml",
+        charm_dir / "charmcraft.yaml",
+        charm_dir / "config.yaml",
+        charm_dir / "actions.yaml",
+        charm_dir / "requirements.txt",
+    ]
+    for tree in ("src", "lib", "scripts", "upstream"):
+        tracked += sorted((charm_dir / tree).rglob("*"))
+    for path in tracked:
+        # skip bytecode left behind by unit-test runs and update.py's
+        # gitignored cache; both churn the digest without changing the
+        # built charm
+        if path.is_file() and not {"__pycache__", ".cache"} & {*path.parts}:
+            digest.update(str(path).encode())
+            digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+
+async def build_charm_cached(ops_test, charm_dir="."):
+    """Build a charm once, reusing the artifact across modules and pytest runs.
+
+    charmcraft pack takes minutes, but the built .charm only changes when the
+    sources do, so artifacts are cached on disk keyed by a source digest.
+    """
+    charm_dir = Path(charm_dir)
+    digest = _charm_source_digest(charm_dir)
+    artifact = _built_charms.get(digest, CHARM_CACHE_DIR / f"{digest}.charm")
+    if not artifact.exists():
+        charm_path = await ops_test.build_charm(charm_dir)
+        CHARM_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(charm_path, artifact)
+    _built_charms[digest] = artifact
+    return artifact
+
 
 def pytest_addoption(parser):
     parser.addoption(
@@ -18,6 +64,28 @@ def pytest_addoption(parser):
     )
 
 
+async def build_resources_cached(ops_test, dest: Path):
+    """Build the calico resource tarballs once, reusing them across runs.
+
+    The tarballs are multi-MB downloads pinned to a calico version by the
+    build script, so the artifacts are cached next to the charm cache,
+    keyed by a digest of the script itself.
+    """
+    script = (Path(__file__).parents[2] / "build-calico-resource.sh").resolve()
+    digest = hashlib.sha256(script.read_bytes()).hexdigest()
+    cache_dir = CHARM_CACHE_DIR / f"resources-{digest}"
+    if cache_dir.is_dir():
+        for tarball in cache_dir.glob("*.tar.gz"):
+            shutil.copy2(tarball, dest / tarball.name)
+        return 0, "", ""
+    retcode, stdout, stderr = await ops_test.run(str(script), cwd=dest)
+    if retcode == 0:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        for tarball in dest.glob("*.tar.gz"):
+            shutil.copy2(tarball, cache_dir / tarball.name)
+    return retcode, stdout, stderr
+
+
 @pytest.fixture(scope="module")
 def k8s_core_bundle(ops_test):
     return ops_test.Bundle("kubernetes-core", channel="edge")
@@ -62,6 +130,8 @@ async def kubernetes(ops_test):
     )
     kubernetes = Kubernetes(namespace, kubeconfig=str(kubeconfig_path))
     namespace_object = {"apiVersion": "v1", "kind": "Namespace", "metadata": {"name": namespace}}
-    kubernetes.apply_object(namespace_object)
+    # kubernetes_wrapper is synchronous; keep its round-trips off the event
+    # loop so concurrent juju awaits aren't frozen behind them
+    await asyncio.to_thread(kubernetes.apply_object, namespace_object)
     yield kubernetes
-    kubernetes.delete_object(namespace_object)
+    await asyncio.to_thread(kubernetes.delete_object, namespace_object)
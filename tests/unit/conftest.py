@@ -1,19 +1,29 @@
 import contextlib
 import unittest.mock as mock
+from pathlib import Path
 
 import ops.testing
 import pytest
+from ops.manifests.manifest import Client
 from ops.testing import Harness
 
-from charm import CalicoCharm
+from charm import CalicoCharm, getContainerRuntimeCtl
 
-ops.testing.SIMULATE_CAN_CONNECT = True
+# read and parse the charm metadata once rather than once per Harness
+_CHARM_ROOT = Path(__file__).parents[2]
+_CHARM_META = (_CHARM_ROOT / "metadata.yaml").read_text()
+_CHARM_CONFIG = (_CHARM_ROOT / "config.yaml").read_text()
+_CHARM_ACTIONS = (_CHARM_ROOT / "actions.yaml").read_text()
 
 
 def pytest_configure(config):
+    # set once for the whole session (and once per xdist worker) instead
+    # of at import of every test module
+    ops.testing.SIMULATE_CAN_CONNECT = True
     markers = {
         "skip_install_calico_binaries": "mark tests which do not mock out _install_calico_binaries",
         "skip_get_cni_config": "mark tests which do not mock out _get_cni_config",
+        "skip_initial_hooks": "mark tests which only need harness.begin(), not the initial hooks",
     }
     for marker, description in markers.items():
         config.addinivalue_line("markers", f"{marker}: {description}")
@@ -21,7 +31,7 @@ def pytest_configure(config):
 
 @pytest.fixture
 def harness():
-    harness = Harness(CalicoCharm)
+    harness = Harness(CalicoCharm, meta=_CHARM_META, config=_CHARM_CONFIG, actions=_CHARM_ACTIONS)
     try:
         yield harness
     finally:
@@ -44,17 +54,35 @@ def charm(request, harness: Harness[CalicoCharm]):
             if marker not in request.keywords:
                 stack.enter_context(mock.patch(f"charm.CalicoCharm.{method}", mock.MagicMock()))
 
-        harness.begin_with_initial_hooks()
+        if "skip_initial_hooks" in request.keywords:
+            # helper-level tests don't need the install/config-changed/start
+            # replay that begin_with_initial_hooks performs
+            harness.begin()
+        else:
+            harness.begin_with_initial_hooks()
         yield harness.charm
 
 
+@pytest.fixture
+def cni_relation(harness: Harness):
+    """Add a cni relation to kubernetes-control-plane with one remote unit joined."""
+    harness.disable_hooks()
+    rel_id = harness.add_relation("cni", "kubernetes-control-plane")
+    harness.add_relation_unit(rel_id, "kubernetes-control-plane/0")
+    return rel_id
+
+
 @pytest.fixture(autouse=True)
 def lk_client():
-    with mock.patch("ops.manifests.manifest.Client", autospec=True) as mock_lightkube:
-        yield mock_lightkube.return_value
+    # spec_set gives the same attribute safety as autospec without
+    # re-introspecting every Client method signature for each test
+    client = mock.MagicMock(spec_set=Client)
+    with mock.patch("ops.manifests.manifest.Client", return_value=client):
+        yield client
 
 
 @pytest.fixture(autouse=True)
 def conctl():
-    with mock.patch("charm.getContainerRuntimeCtl", autospec=True) as mock_conctl:
-        yield mock_conctl.return_value
+    ctl = mock.MagicMock(spec_set=getContainerRuntimeCtl)
+    with mock.patch("charm.getContainerRuntimeCtl", ctl):
+        yield ctl.return_value
@@ -4,17 +4,15 @@
 # Learn more about testing at: https://juju.is/docs/sdk/testing
 
 
-import ipaddress
 import os
+import subprocess
 import unittest.mock as mock
-from asyncio import subprocess
 from ipaddress import ip_network
+from json import JSONDecodeError
 from pathlib import Path
 from subprocess import CalledProcessError, CompletedProcess
 from typing import Optional, Set
 
-import ops
-import ops.testing
 import pytest
 from ops.manifests import ManifestClientError
 from ops.model import ActiveStatus, BlockedStatus, ModelError, WaitingStatus
@@ -23,7 +21,42 @@ from yaml import YAMLError
 
 from charm import CalicoCharm
 
-ops.testing.SIMULATE_CAN_CONNECT = True
+# exception doubles shared across parametrize lists and side_effects,
+# built once at module import instead of on every collection pass
+CPE_GENERIC = CalledProcessError(1, "foo")
+CPE_WITH_OUTPUT = CalledProcessError(1, "foo", b"some output", b"some error")
+CPE_NOT_EXIST = CalledProcessError(1, "foo", b"some output", b"resource does not exist")
+
+# unit-bgp-peers config payload shared by the peer tests; kept as the raw
+# string the charm would receive so its own YAML parsing stays exercised
+UNIT_BGP_PEERS_YAML = (
+    "{0: [{address: 10.0.0.1, as-number: 65000}, {address: 10.0.0.2, as-number: 65001}],"
+    " 1: [{address: 10.0.1.1, as-number: 65002}]}"
+)
+
+# canonical calicoctl get responses shared read-only across tests
+POOL_LIST_INTERGALACTIC = {
+    "items": [
+        {
+            "apiVersion": "projectcalico.org/v3",
+            "kind": "IPPool",
+            "metadata": {"name": "intergalactic"},
+            "spec": {
+                "cidr": "10.0.1.0/24",
+                "ipipMode": "Always",
+                "vxlanMode": "Never",
+                "natOutgoing": True,
+            },
+        },
+    ]
+}
+
+# networks reused across tests and in decorator/parametrize expressions,
+# parsed once at module import
+NET_10_0_0_0_24 = ip_network("10.0.0.0/24")
+NET_10_0_0_0_16 = ip_network("10.0.0.0/16")
+NET_192_168_0_0_24 = ip_network("192.168.0.0/24")
+NET_192_168_1_0_24 = ip_network("192.168.1.0/24")
 
 
 class NetworkMock:
@@ -43,7 +76,7 @@ def test_on_etcd_changed(
     harness: Harness, charm: CalicoCharm, caplog, deployed: bool, side_effect: Exception
 ):
     with mock.patch.object(charm.calico_manifests, "apply_manifests") as mock_apply:
-        mock_event = mock.MagicMock()
+        mock_event = mock.Mock(spec_set=["defer"])
         mock_apply.side_effect = side_effect
         charm.stored.deployed = deployed
         charm._on_etcd_changed(mock_event)
@@ -61,7 +94,7 @@ def test_on_etcd_changed(
     [
         pytest.param(True, None, id="Calico deployed"),
         pytest.param(False, None, id="Calico not deployed"),
-        pytest.param(True, CalledProcessError(1, "foo"), id="CalicoCTL unavailable"),
+        pytest.param(True, CPE_GENERIC, id="CalicoCTL unavailable"),
         pytest.param(True, YAMLError(), id="Configuration error"),
     ],
 )
@@ -76,7 +109,7 @@ def test_on_config_changed(
     with mock.patch.object(charm.calico_manifests, "apply_manifests"):
         harness.disable_hooks()
         charm.stored.deployed = deployed
-        mock_event = mock.MagicMock()
+        mock_event = mock.Mock(spec_set=["defer"])
         mock_configure.side_effect = side_effect
         charm._on_config_changed(mock_event)
         if deployed:
@@ -92,27 +125,19 @@ def test_on_config_changed(
             mock_configure.assert_not_called()
 
 
-@mock.patch("charm.CalicoCharm._configure_calico_pool")
-@mock.patch("charm.CalicoCharm._configure_node")
-@mock.patch("charm.CalicoCharm._configure_bgp_globals")
-@mock.patch("charm.CalicoCharm._configure_bgp_peers")
-@mock.patch("charm.CalicoCharm._disable_vxlan_tx_checksumming")
-def test_configure_calico(
-    mock_config_pool: mock.MagicMock,
-    mock_config_node: mock.MagicMock,
-    mock_bgp_globals: mock.MagicMock,
-    mock_bgp_peers: mock.MagicMock,
-    mock_vxlan: mock.MagicMock,
-    harness: Harness,
-    charm: CalicoCharm,
-):
+@mock.patch.multiple(
+    "charm.CalicoCharm",
+    _configure_calico_pool=mock.DEFAULT,
+    _configure_node=mock.DEFAULT,
+    _configure_bgp_globals=mock.DEFAULT,
+    _configure_bgp_peers=mock.DEFAULT,
+    _disable_vxlan_tx_checksumming=mock.DEFAULT,
+)
+def test_configure_calico(harness: Harness, charm: CalicoCharm, **mocks: mock.MagicMock):
     harness.disable_hooks()
     charm._configure_calico()
-    mock_config_pool.assert_called_once()
-    mock_config_node.assert_called_once()
-    mock_bgp_globals.assert_called_once()
-    mock_bgp_peers.assert_called_once()
-    mock_vxlan.assert_called_once()
+    for mocked in mocks.values():
+        mocked.assert_called_once()
 
 
 @mock.patch("charm.CalicoCharm._configure_calico_pool")
@@ -123,88 +148,35 @@ def test_configure_calico_exception_handling(mock_configure: mock.MagicMock, cha
     assert not charm.stored.calico_configured
 
 
-@mock.patch("charm.CalicoCharm._set_status")
-@mock.patch("charm.CalicoCharm._configure_calico")
-@mock.patch("charm.CalicoCharm._configure_cni")
-@mock.patch("charm.CalicoCharm._get_kubeconfig_status", return_value=True)
-def test_install_or_upgrade(
-    mock_kubeconfig: mock.MagicMock,
-    mock_cni: mock.MagicMock,
-    mock_configure: mock.MagicMock,
-    mock_set_status: mock.MagicMock,
-    charm: CalicoCharm,
-):
-    with mock.patch.object(charm, "etcd") as mock_etcd, mock.patch.object(
-        charm.calico_manifests, "apply_manifests"
-    ) as mock_apply:
-        mock_etcd.return_value.is_ready.return_value = True
-        mock_event = mock.MagicMock()
-        charm._install_or_upgrade(mock_event)
-        mock_cni.assert_called_once()
-        mock_configure.assert_called_once()
-        mock_set_status.assert_called_once()
-        mock_apply.assert_called_once()
-        assert charm.stored.deployed
-
-
-@mock.patch("charm.CalicoCharm._set_status")
-@mock.patch("charm.CalicoCharm._configure_calico")
-@mock.patch("charm.CalicoCharm._configure_cni")
-@mock.patch("charm.CalicoCharm._get_kubeconfig_status", return_value=True)
-def test_install_or_upgrade_etcd_unavailable(
-    mock_kubeconfig: mock.MagicMock,
-    mock_cni: mock.MagicMock,
-    mock_configure: mock.MagicMock,
-    mock_set_status: mock.MagicMock,
-    charm: CalicoCharm,
-):
-    with mock.patch.object(charm, "etcd") as mock_etcd, mock.patch.object(
-        charm.calico_manifests, "apply_manifests"
-    ):
-        mock_etcd.is_ready = False
-        mock_event = mock.MagicMock()
-        charm._install_or_upgrade(mock_event)
-        assert charm.unit.status == BlockedStatus("Waiting for etcd.")
-        mock_event.defer.assert_called_once()
-        assert not charm.stored.deployed
-
-
-@mock.patch("charm.CalicoCharm._set_status")
-@mock.patch("charm.CalicoCharm._configure_calico")
-@mock.patch("charm.CalicoCharm._configure_cni")
-@mock.patch("charm.CalicoCharm._get_kubeconfig_status", return_value=True)
-def test_install_or_upgrade_config(
-    mock_kubeconfig: mock.MagicMock,
-    mock_cni: mock.MagicMock,
-    mock_configure: mock.MagicMock,
-    mock_set_status: mock.MagicMock,
-    charm: CalicoCharm,
-):
-    with mock.patch.object(charm, "etcd") as mock_etcd, mock.patch.object(
-        charm.calico_manifests, "apply_manifests"
-    ):
-        mock_etcd.return_value.is_ready.return_value = True
-        mock_event = mock.MagicMock()
-        mock_configure.side_effect = YAMLError("foo")
-        charm._install_or_upgrade(mock_event)
-        assert charm.unit.status == BlockedStatus(
-            "Invalid Config provided. Please check juju debug-log for more info."
-        )
-        mock_event.defer.assert_not_called()
-        assert not charm.stored.deployed
-
-
 @pytest.mark.parametrize(
-    "side_effect,status",
+    "etcd_ready,side_effect,expected_status,expect_defer,expect_deployed",
     [
+        pytest.param(True, None, None, False, True, id="Success"),
         pytest.param(
+            False, None, BlockedStatus("Waiting for etcd."), True, False, id="Etcd unavailable"
+        ),
+        pytest.param(
+            True,
+            YAMLError("foo"),
+            BlockedStatus("Invalid Config provided. Please check juju debug-log for more info."),
+            False,
+            False,
+            id="Invalid config",
+        ),
+        pytest.param(
+            True,
             ManifestClientError("foo"),
             WaitingStatus("Installing Calico manifests"),
+            True,
+            False,
             id="ManifestClientError",
         ),
         pytest.param(
-            CalledProcessError(1, "foo"),
+            True,
+            CPE_GENERIC,
             WaitingStatus("Configuring Calico"),
+            True,
+            False,
             id="CalledProcessError",
         ),
     ],
@@ -213,25 +185,35 @@ def test_install_or_upgrade_config(
 @mock.patch("charm.CalicoCharm._configure_calico")
 @mock.patch("charm.CalicoCharm._configure_cni")
 @mock.patch("charm.CalicoCharm._get_kubeconfig_status", return_value=True)
-def test_install_or_upgrade_exception(
+def test_install_or_upgrade(
     mock_kubeconfig: mock.MagicMock,
     mock_cni: mock.MagicMock,
     mock_configure: mock.MagicMock,
     mock_set_status: mock.MagicMock,
     charm: CalicoCharm,
-    side_effect: Exception,
-    status,
+    etcd_ready: bool,
+    side_effect: Optional[Exception],
+    expected_status,
+    expect_defer: bool,
+    expect_deployed: bool,
 ):
-    with mock.patch.object(charm, "etcd") as mock_etcd, mock.patch.object(
-        charm.calico_manifests, "apply_manifests"
+    mock_etcd = mock.Mock(spec_set=["is_ready", "save_client_credentials"], is_ready=etcd_ready)
+    with (
+        mock.patch.object(charm, "etcd", new=mock_etcd),
+        mock.patch.object(charm.calico_manifests, "apply_manifests") as mock_apply,
     ):
-        mock_etcd.return_value.is_ready.return_value = True
-        mock_event = mock.MagicMock()
         mock_configure.side_effect = side_effect
+        mock_event = mock.Mock(spec_set=["defer"])
         charm._install_or_upgrade(mock_event)
-        assert charm.unit.status == status
-        mock_event.defer.assert_called_once()
-        assert not charm.stored.deployed
+        if expected_status is None:
+            mock_cni.assert_called_once()
+            mock_configure.assert_called_once()
+            mock_set_status.assert_called_once()
+            mock_apply.assert_called_once()
+        else:
+            assert charm.unit.status == expected_status
+        assert mock_event.defer.called is expect_defer
+        assert charm.stored.deployed is expect_deployed
 
 
 @mock.patch("charm.CalicoCharm._install_or_upgrade")
@@ -240,20 +222,17 @@ def test_on_upgrade(
     mock_remove: mock.MagicMock, mock_install: mock.MagicMock, harness: Harness, charm: CalicoCharm
 ):
     harness.disable_hooks()
-    mock_event = mock.MagicMock()
+    mock_event = mock.Mock(spec_set=["defer"])
     charm._on_upgrade(mock_event)
     mock_remove.assert_called_once()
     mock_install.assert_called_once_with(mock_event)
 
 
-def test_get_kubeconfig_status(harness, charm):
-    harness.disable_hooks()
-    rel_id = harness.add_relation("cni", "kubernetes-control-plane")
-    harness.add_relation_unit(rel_id, "kubernetes-control-plane/0")
+def test_get_kubeconfig_status(harness, charm, cni_relation):
     assert not charm._get_kubeconfig_status()
 
     harness.update_relation_data(
-        rel_id, "kubernetes-control-plane/0", {"kubeconfig-hash": "abcd1234"}
+        cni_relation, "kubernetes-control-plane/0", {"kubeconfig-hash": "abcd1234"}
     )
     assert charm._get_kubeconfig_status()
 
@@ -287,8 +266,30 @@ def test_set_status_rpf_mismatched(mock_rpf: mock.MagicMock, charm: CalicoCharm)
         )
 
 
+@pytest.mark.parametrize(
+    "rp_filter,ignore_loose,expected",
+    [
+        pytest.param(b"2", False, True, id="Loose rpf, not ignored"),
+        pytest.param(b"1", False, False, id="Strict rpf, not ignored"),
+        pytest.param(b"2", True, False, id="Loose rpf, ignored"),
+        pytest.param(b"1", True, False, id="Strict rpf, ignored"),
+    ],
+)
+@pytest.mark.skip_initial_hooks
+def test_is_rpf_config_mismatched(
+    harness: Harness, charm: CalicoCharm, rp_filter: bytes, ignore_loose: bool, expected: bool
+):
+    harness.update_config({"ignore-loose-rpf": ignore_loose})
+    with (
+        mock.patch("charm.os.open"),
+        mock.patch("charm.os.close"),
+        mock.patch("charm.os.read", return_value=rp_filter),
+    ):
+        assert charm._is_rpf_config_mismatched() is expected
+
+
 def test_on_etcd_connected(charm: CalicoCharm):
-    mock_event = mock.MagicMock()
+    mock_event = mock.Mock(spec_set=["defer"])
     charm._on_etcd_connected(mock_event)
     assert charm.unit.status == BlockedStatus("Waiting for relation to etcd.")
 
@@ -376,65 +377,45 @@ def test_get_ip_versions(mock_get_networks: mock.MagicMock, harness: Harness, ch
     assert result == {4, 6}
 
 
+@pytest.mark.skip_initial_hooks
 def test_get_networks(charm: CalicoCharm):
     cidrs = "192.168.0.0/24,10.0.0.0/16"
 
     result = charm._get_networks(cidrs)
-    expected_result = [ipaddress.ip_network("192.168.0.0/24"), ipaddress.ip_network("10.0.0.0/16")]
+    expected_result = [NET_192_168_0_0_24, NET_10_0_0_0_16]
 
     assert result == expected_result
 
 
-@mock.patch("charm.CalicoCharm._calicoctl_apply")
-@mock.patch("charm.CalicoCharm._calicoctl_get")
+@pytest.mark.parametrize(
+    "patch_side,apply_side,expects_raise,log_contains",
+    [
+        pytest.param(None, None, False, None, id="Patch succeeds"),
+        pytest.param(
+            CPE_WITH_OUTPUT, None, True, "Failed to apply BGPConfiguration", id="Patch raises"
+        ),
+        pytest.param(CPE_NOT_EXIST, CPE_GENERIC, True, None, id="Apply raises"),
+        pytest.param(
+            CPE_NOT_EXIST,
+            None,
+            False,
+            "default BGPConfiguration does not exist.",
+            id="Resource created",
+        ),
+    ],
+)
+@mock.patch.multiple(
+    "charm.CalicoCharm", _calicoctl_patch=mock.DEFAULT, _calicoctl_apply=mock.DEFAULT
+)
 def test_configure_bgp_globals(
-    mock_get: mock.MagicMock, mock_apply: mock.MagicMock, harness: Harness, charm: CalicoCharm
-):
-    harness.update_config(
-        {
-            "global-as-number": 64511,
-            "bgp-service-cluster-ips": "10.0.0.0/16",
-            "bgp-service-external-ips": "192.168.0.0/16",
-            "bgp-service-loadbalancer-ips": "172.16.0.0/16",
-        }
-    )
-    mock_get.return_value = {
-        "apiVersion": "projectcalico.org/v3",
-        "kind": "BGPConfiguration",
-        "metadata": {"name": "default"},
-        "spec": {},
-    }
-
-    charm._configure_bgp_globals()
-    mock_get.assert_called_once_with("bgpconfig", "default")
-    mock_apply.assert_called_once()
-
-    apply_args, _ = mock_apply.call_args
-    applied_config = apply_args[0]
-
-    assert applied_config["spec"]["asNumber"] == 64511
-    assert applied_config["spec"]["serviceClusterIPs"] == [{"cidr": "10.0.0.0/16"}]
-    assert applied_config["spec"]["serviceExternalIPs"] == [{"cidr": "192.168.0.0/16"}]
-    assert applied_config["spec"]["serviceLoadBalancerIPs"] == [{"cidr": "172.16.0.0/16"}]
-
-
-@mock.patch("charm.CalicoCharm._calicoctl_get")
-def test_configure_bgp_globals_get_raises(mock_get: mock.MagicMock, charm: CalicoCharm, caplog):
-    mock_get.side_effect = CalledProcessError(1, "foo", b"some output", b"some error")
-
-    with pytest.raises(CalledProcessError):
-        charm._configure_bgp_globals()
-        assert "Failed to get BGPConfiguration" in caplog.text
-
-
-@mock.patch("charm.CalicoCharm._calicoctl_apply")
-@mock.patch("charm.CalicoCharm._calicoctl_get")
-def test_configure_bgp_globals_apply_raises(
-    mock_get: mock.MagicMock,
-    mock_apply: mock.MagicMock,
     harness: Harness,
     charm: CalicoCharm,
     caplog,
+    patch_side,
+    apply_side,
+    expects_raise,
+    log_contains,
+    **mocks,
 ):
     harness.update_config(
         {
@@ -444,47 +425,38 @@ def test_configure_bgp_globals_apply_raises(
             "bgp-service-loadbalancer-ips": "172.16.0.0/16",
         }
     )
-    mock_get.side_effect = CalledProcessError(1, "foo", b"some output", b"resource does not exist")
-    mock_apply.side_effect = CalledProcessError(1, "foo")
+    mock_patch, mock_apply = mocks["_calicoctl_patch"], mocks["_calicoctl_apply"]
+    mock_patch.side_effect = patch_side
+    mock_apply.side_effect = apply_side
 
-    with pytest.raises(CalledProcessError):
+    if expects_raise:
+        with pytest.raises(CalledProcessError):
+            charm._configure_bgp_globals()
+    else:
         charm._configure_bgp_globals()
+        mock_patch.assert_called_once()
+        if patch_side is None:
+            patch_args, _ = mock_patch.call_args
+            assert patch_args[:2] == ("bgpconfig", "default")
+            patched_spec = patch_args[2]["spec"]
+
+            assert patched_spec["asNumber"] == 64511
+            assert patched_spec["serviceClusterIPs"] == [{"cidr": "10.0.0.0/16"}]
+            assert patched_spec["serviceExternalIPs"] == [{"cidr": "192.168.0.0/16"}]
+            assert patched_spec["serviceLoadBalancerIPs"] == [{"cidr": "172.16.0.0/16"}]
+        else:
+            mock_apply.assert_called_once()
 
-
-@mock.patch("charm.CalicoCharm._calicoctl_apply")
-@mock.patch("charm.CalicoCharm._calicoctl_get")
-def test_configure_bgp_globals_resource(
-    mock_get: mock.MagicMock,
-    mock_apply: mock.MagicMock,
-    harness: Harness,
-    charm: CalicoCharm,
-    caplog,
-):
-    harness.update_config(
-        {
-            "global-as-number": 64511,
-            "bgp-service-cluster-ips": "10.0.0.0/16",
-            "bgp-service-external-ips": "192.168.0.0/16",
-            "bgp-service-loadbalancer-ips": "172.16.0.0/16",
-        }
-    )
-    mock_get.side_effect = CalledProcessError(1, "foo", b"some output", b"resource does not exist")
-
-    charm._configure_bgp_globals()
-    mock_get.assert_called_once_with("bgpconfig", "default")
-    mock_apply.assert_called_once()
-
-    assert "default BGPConfiguration does not exist." in caplog.text
+    if log_contains:
+        assert log_contains in caplog.text
 
 
 @mock.patch("charm.gethostname")
 @mock.patch("charm.CalicoCharm._get_unit_as_number")
 @mock.patch("charm.CalicoCharm._get_route_reflector_cluster_id")
-@mock.patch("charm.CalicoCharm._calicoctl_apply")
-@mock.patch("charm.CalicoCharm._calicoctl_get")
+@mock.patch("charm.CalicoCharm._calicoctl_patch")
 def test_configure_node(
-    mock_get: mock.MagicMock,
-    mock_apply: mock.MagicMock,
+    mock_patch: mock.MagicMock,
     mock_cluster_id: mock.MagicMock,
     mock_unit: mock.MagicMock,
     mock_hostname: mock.MagicMock,
@@ -493,30 +465,26 @@ def test_configure_node(
     mock_hostname.return_value = "test-node"
     mock_unit.return_value = 64511
     mock_cluster_id.return_value = "224.0.0.1"
-    mock_get.return_value = {
-        "apiVersion": "projectcalico.org/v3",
-        "kind": "BGPConfiguration",
-        "metadata": {"name": "default"},
-        "spec": {"bgp": {}},
-    }
 
     charm._configure_node()
 
-    mock_get.assert_called_once_with("node", "test-node")
-    mock_apply.assert_called_once()
-
-    apply_args, _ = mock_apply.call_args
-    applied_config = apply_args[0]
-    assert applied_config["spec"]["bgp"]["asNumber"] == 64511
-    assert applied_config["spec"]["bgp"]["routeReflectorClusterID"] == "224.0.0.1"
+    mock_patch.assert_called_once_with(
+        "node",
+        "test-node",
+        {"spec": {"bgp": {"asNumber": 64511, "routeReflectorClusterID": "224.0.0.1"}}},
+    )
 
 
+@mock.patch("charm.CalicoCharm._get_route_reflector_cluster_id")
 @mock.patch("charm.CalicoCharm._get_unit_as_number")
-@mock.patch("charm.CalicoCharm._calicoctl_get")
+@mock.patch("charm.CalicoCharm._calicoctl_patch")
 def test_configure_node_raises(
-    mock_get: mock.MagicMock, mock_unit: mock.MagicMock, charm: CalicoCharm
+    mock_patch: mock.MagicMock,
+    mock_unit: mock.MagicMock,
+    mock_cluster_id: mock.MagicMock,
+    charm: CalicoCharm,
 ):
-    mock_get.side_effect = CalledProcessError(1, "foo", b"some output", b"some error")
+    mock_patch.side_effect = CPE_WITH_OUTPUT
     mock_unit.return_value = 64511
 
     with pytest.raises(CalledProcessError):
@@ -547,13 +515,13 @@ def test_get_unit_as_number_subnet(
             "subnet-as-numbers": "{10.0.0.0/24: 64515, 10.0.1.0/24: 64513}",
         }
     )
-    mock_filter.return_value = [ip_network("10.0.0.0/24")]
+    mock_filter.return_value = [NET_10_0_0_0_24]
     result = charm._get_unit_as_number()
 
     assert result == 64515
 
 
-@mock.patch("charm.CalicoCharm._filter_local_subnets", return_value=[ip_network("10.0.0.0/24")])
+@mock.patch("charm.CalicoCharm._filter_local_subnets", return_value=[NET_10_0_0_0_24])
 @mock.patch("charm.CalicoCharm._get_unit_id", return_value=0)
 def test_get_unit_as_number_no_as_subnet(
     mock_unit: mock.MagicMock, mock_filter: mock.MagicMock, harness: Harness, charm: CalicoCharm
@@ -575,22 +543,23 @@ def test_get_unit_as_number_none(
     assert result is None
 
 
+@pytest.mark.skip_initial_hooks
 @mock.patch("charm.CalicoCharm._get_bind_address")
 def test_filter_local_subnets(mock_bind: mock.MagicMock, charm: CalicoCharm):
     mock_bind.return_value = "192.168.1.3"
 
     subnets = ["192.168.1.0/24", "10.0.0.0/16"]
     result = charm._filter_local_subnets(subnets)
-    expected = [ip_network("192.168.1.0/24")]
+    expected = [NET_192_168_1_0_24]
 
     assert result == expected
 
 
 @mock.patch("charm.gethostname", return_value="test-node")
 @mock.patch("charm.CalicoCharm.calicoctl")
-@mock.patch("charm.CalicoCharm._calicoctl_apply")
+@mock.patch("charm.CalicoCharm._calicoctl_apply_many")
 @mock.patch("charm.CalicoCharm._calicoctl_get")
-@mock.patch("charm.CalicoCharm._filter_local_subnets", return_value=[ip_network("10.0.0.0/24")])
+@mock.patch("charm.CalicoCharm._filter_local_subnets", return_value=[NET_10_0_0_0_24])
 @mock.patch("charm.CalicoCharm._get_unit_id", return_value=0)
 def test_configure_bgp_peers_unit_peers(
     mock_unit: mock.MagicMock,
@@ -602,52 +571,42 @@ def test_configure_bgp_peers_unit_peers(
     harness: Harness,
     charm: CalicoCharm,
 ):
-    harness.update_config(
-        {
-            "unit-bgp-peers": "{0: [{address: 10.0.0.1, as-number: 65000}, {address: 10.0.0.2, as-number: 65001}], 1: [{address: 10.0.1.1, as-number: 65002}]}"
-        }
-    )
-    rogue_def = {
-        "items": [
-            {
-                "apiVersion": "projectcalico.org/v3",
-                "kind": "BGPPeer",
-                "metadata": {"name": "calico-0-10.20.0.1-65000"},
-                "spec": {"node": "test-node", "peerIP": "10.0.0.1", "asNumber": 65000},
-            }
-        ]
-    }
-    mock_get.return_value = rogue_def
+    harness.update_config({"unit-bgp-peers": UNIT_BGP_PEERS_YAML})
+    mock_calicoctl.return_value = b"calico-0-10.20.0.1-65000"
 
     charm._configure_bgp_peers()
-    mock_calicoctl.assert_called_once_with("delete", "bgppeer", "calico-0-10.20.0.1-65000")
-    mock_apply.assert_has_calls(
+    mock_calicoctl.assert_has_calls(
         [
             mock.call(
-                {
-                    "apiVersion": "projectcalico.org/v3",
-                    "kind": "BGPPeer",
-                    "metadata": {"name": "calico-0-10.0.0.1-65000"},
-                    "spec": {"node": "test-node", "peerIP": "10.0.0.1", "asNumber": 65000},
-                }
-            ),
-            mock.call(
-                {
-                    "apiVersion": "projectcalico.org/v3",
-                    "kind": "BGPPeer",
-                    "metadata": {"name": "calico-0-10.0.0.2-65001"},
-                    "spec": {"node": "test-node", "peerIP": "10.0.0.2", "asNumber": 65001},
-                }
+                "get", "bgppeers", "-o", "go-template={{range .items}}{{.metadata.name}} {{end}}"
             ),
+            mock.call("delete", "bgppeer", "calico-0-10.20.0.1-65000", "--skip-not-exists"),
+        ]
+    )
+    assert mock_calicoctl.call_count == 2
+    mock_apply.assert_called_once_with(
+        [
+            {
+                "apiVersion": "projectcalico.org/v3",
+                "kind": "BGPPeer",
+                "metadata": {"name": "calico-0-10.0.0.1-65000"},
+                "spec": {"node": "test-node", "peerIP": "10.0.0.1", "asNumber": 65000},
+            },
+            {
+                "apiVersion": "projectcalico.org/v3",
+                "kind": "BGPPeer",
+                "metadata": {"name": "calico-0-10.0.0.2-65001"},
+                "spec": {"node": "test-node", "peerIP": "10.0.0.2", "asNumber": 65001},
+            },
         ]
     )
 
 
 @mock.patch("charm.gethostname", return_value="test-node")
 @mock.patch("charm.CalicoCharm.calicoctl")
-@mock.patch("charm.CalicoCharm._calicoctl_apply")
+@mock.patch("charm.CalicoCharm._calicoctl_apply_many")
 @mock.patch("charm.CalicoCharm._calicoctl_get")
-@mock.patch("charm.CalicoCharm._filter_local_subnets", return_value=[ip_network("10.0.0.0/24")])
+@mock.patch("charm.CalicoCharm._filter_local_subnets", return_value=[NET_10_0_0_0_24])
 @mock.patch("charm.CalicoCharm._get_unit_id", return_value=0)
 def test_configure_bgp_peers_raises(
     mock_unit: mock.MagicMock,
@@ -660,11 +619,7 @@ def test_configure_bgp_peers_raises(
     charm: CalicoCharm,
     caplog,
 ):
-    harness.update_config(
-        {
-            "unit-bgp-peers": "{0: [{address: 10.0.0.1, as-number: 65000}, {address: 10.0.0.2, as-number: 65001}], 1: [{address: 10.0.1.1, as-number: 65002}]}"
-        }
-    )
+    harness.update_config({"unit-bgp-peers": UNIT_BGP_PEERS_YAML})
     mock_apply.side_effect = CalledProcessError(1, "foo", "some output", "some error")
     with pytest.raises(CalledProcessError):
         charm._configure_bgp_peers()
@@ -769,12 +724,8 @@ def test_disable_vxlan_tx_checksumming_raises(
     )
 
 
-def test_propagate_cni_config(harness: Harness, charm: CalicoCharm):
-    harness.disable_hooks()
-    config_dict = {"cidr": "10.0.0.0/24"}
-    harness.update_config(config_dict)
-    rel_id = harness.add_relation("cni", "kubernetes-control-plane")
-    harness.add_relation_unit(rel_id, "kubernetes-control-plane/0")
+def test_propagate_cni_config(harness: Harness, charm: CalicoCharm, cni_relation):
+    harness.update_config({"cidr": "10.0.0.0/24"})
 
     charm._propagate_cni_config()
     assert len(harness.model.relations["cni"]) == 1
@@ -795,7 +746,7 @@ def test_configure_calico_pool_unmanaged(
     assert "Skipping pool configuration." in caplog.text
 
 
-@mock.patch("charm.CalicoCharm._calicoctl_apply")
+@mock.patch("charm.CalicoCharm._calicoctl_apply_many")
 @mock.patch("charm.CalicoCharm.calicoctl")
 @mock.patch("charm.CalicoCharm._calicoctl_get")
 def test_configure_calico_pool(
@@ -816,40 +767,28 @@ def test_configure_calico_pool(
         }
     )
 
-    mock_get.return_value = {
-        "items": [
+    mock_get.return_value = POOL_LIST_INTERGALACTIC
+    charm._configure_calico_pool()
+    mock_get.assert_called_once_with("pool")
+    mock_calicoctl.assert_called_once_with("delete", "pool", "intergalactic", "--skip-not-exists")
+    mock_apply.assert_called_once_with(
+        [
             {
                 "apiVersion": "projectcalico.org/v3",
                 "kind": "IPPool",
-                "metadata": {"name": "intergalactic"},
+                "metadata": {"name": "ipv4"},
                 "spec": {
-                    "cidr": "10.0.1.0/24",
+                    "cidr": "192.0.2.0/24",
                     "ipipMode": "Always",
                     "vxlanMode": "Never",
                     "natOutgoing": True,
                 },
-            },
+            }
         ]
-    }
-    charm._configure_calico_pool()
-    mock_get.assert_called_once_with("pool")
-    mock_calicoctl.assert_called_once_with("delete", "pool", "intergalactic", "--skip-not-exists")
-    mock_apply.assert_called_once_with(
-        {
-            "apiVersion": "projectcalico.org/v3",
-            "kind": "IPPool",
-            "metadata": {"name": "ipv4"},
-            "spec": {
-                "cidr": "192.0.2.0/24",
-                "ipipMode": "Always",
-                "vxlanMode": "Never",
-                "natOutgoing": True,
-            },
-        }
     )
 
 
-@mock.patch("charm.CalicoCharm._calicoctl_get", side_effect=CalledProcessError(1, "foo"))
+@mock.patch("charm.CalicoCharm._calicoctl_get", side_effect=CPE_GENERIC)
 def test_configure_calico_pool_raises(
     mock_get: mock.MagicMock, harness: Harness, charm: CalicoCharm, caplog
 ):
@@ -970,7 +909,7 @@ def test_update_calicoctl_env(
         "ETCD_CA_CERT_FILE": "/foo/path/ca",
     }
     mock_get_env.return_value = env
-    mock_event = mock.MagicMock()
+    mock_event = mock.Mock(spec_set=["defer"])
     charm._update_calicoctl_env(mock_event)
 
     mock_path.assert_called_once_with(parents=True, exist_ok=True)
@@ -985,6 +924,7 @@ def test_update_calicoctl_env(
     "charms.kubernetes_libs.v0.etcd.EtcdReactiveRequires.get_connection_string",
     return_value="https://10.0.10.24:4343",
 )
+@pytest.mark.skip_initial_hooks
 def test_get_calicoctl_env(mock_etcd: mock.PropertyMock, charm: CalicoCharm):
     expected_env = {
         "ETCD_ENDPOINTS": "https://10.0.10.24:4343",
@@ -997,56 +937,75 @@ def test_get_calicoctl_env(mock_etcd: mock.PropertyMock, charm: CalicoCharm):
     assert expected_env == result
 
 
-@mock.patch("tarfile.open")
-def test_unpack_archive(mock_tarfile_open: mock.MagicMock, charm: CalicoCharm):
+@pytest.mark.skip_initial_hooks
+@mock.patch("subprocess.check_call")
+def test_unpack_archive(mock_check_call: mock.MagicMock, charm: CalicoCharm):
     source_path = "/test/path"
     dst_path = "/dst/path"
 
     charm._unpack_archive(source_path, dst_path)
-    mock_tarfile_open.assert_called_once_with(source_path)
-    mock_tarfile_open().extractall.assert_called_once_with(dst_path)
+    mock_check_call.assert_called_once_with(["tar", "-xf", source_path, "-C", dst_path])
 
 
+@pytest.mark.skip_initial_hooks
 @mock.patch("charm.CalicoCharm.calicoctl")
-@mock.patch("tempfile.TemporaryDirectory")
-@mock.patch("builtins.open")
-def test_calicoctl_apply(
-    mock_open: mock.MagicMock,
-    mock_tempdir: mock.MagicMock,
-    mock_calicoctl: mock.MagicMock,
-    charm: CalicoCharm,
-):
+def test_calicoctl_apply(mock_calicoctl: mock.MagicMock, charm: CalicoCharm):
     test_data = {"key": "value"}
-    mock_tempdir.return_value.__enter__.return_value = "/tmp/dir"
     charm._calicoctl_apply(test_data)
 
-    mock_tempdir.assert_called_once()
-    filename = "/tmp/dir/calicoctl_manifest.yaml"
-    mock_open.assert_called_once_with(filename, "w")
-    mock_calicoctl.assert_called_once_with("apply", "-f", filename)
+    mock_calicoctl.assert_called_once_with("apply", "-f", "-", input=b'{"key": "value"}')
 
 
+@pytest.mark.skip_initial_hooks
+@mock.patch("charm.CalicoCharm.calicoctl")
+def test_calicoctl_apply_many(mock_calicoctl: mock.MagicMock, charm: CalicoCharm):
+    test_data = [{"key": "value"}, {"key": "other"}]
+    charm._calicoctl_apply_many(test_data)
+
+    mock_calicoctl.assert_called_once_with(
+        "apply", "-f", "-", input=b'{"key": "value"}\n---\n{"key": "other"}'
+    )
+
+
+@pytest.mark.skip_initial_hooks
+@mock.patch("charm.CalicoCharm.calicoctl")
+def test_calicoctl_patch(mock_calicoctl: mock.MagicMock, charm: CalicoCharm):
+    charm._calicoctl_patch("node", "test-node", {"spec": {"bgp": {"asNumber": 64511}}})
+
+    mock_calicoctl.assert_called_once_with(
+        "patch",
+        "node",
+        "test-node",
+        "--patch",
+        '{"spec": {"bgp": {"asNumber": 64511}}}',
+        "--type=merge",
+    )
+
+
+@pytest.mark.skip_initial_hooks
 @mock.patch("charm.CalicoCharm.calicoctl")
 def test_calicoctl_get(mock_calicoctl: mock.MagicMock, charm: CalicoCharm):
     test_args = ("node", "juju-a43756-1")
-    expected_args = ("get", "-o", "yaml", "--export") + test_args
+    expected_args = ("get", "-o", "json", "--export") + test_args
     expected_dict = {"key": "value"}
-    mock_calicoctl.return_value = "key: value"
+    mock_calicoctl.return_value = '{"key": "value"}'
     result = charm._calicoctl_get(*test_args)
 
     mock_calicoctl.assert_called_once_with(*expected_args)
     assert result == expected_dict
 
 
+@pytest.mark.skip_initial_hooks
 @mock.patch("charm.CalicoCharm.calicoctl")
 def test_calicoctl_get_raises(mock_calicoctl: mock.MagicMock, charm: CalicoCharm, caplog):
     test_args = ("node", "juju-a43756-1")
-    mock_calicoctl.return_value = 'key: - "value2 : a'
-    with pytest.raises(YAMLError):
+    mock_calicoctl.return_value = '{"key": not valid json'
+    with pytest.raises(JSONDecodeError):
         charm._calicoctl_get(*test_args)
-    assert "Failed to parse calicoctl output as yaml" in caplog.text
+    assert "Failed to parse calicoctl output as json" in caplog.text
 
 
+@pytest.mark.skip_initial_hooks
 @mock.patch("subprocess.check_output")
 @mock.patch("charm.CalicoCharm._get_calicoctl_env")
 def test_calicoctl(mock_get: mock.MagicMock, mock_check: mock.MagicMock, charm: CalicoCharm):
@@ -1059,10 +1018,11 @@ def test_calicoctl(mock_get: mock.MagicMock, mock_check: mock.MagicMock, charm:
     charm.calicoctl(*test_args)
 
     mock_check.assert_called_once_with(
-        expected_cmd, env=expected_env, stderr=subprocess.PIPE, timeout=60
+        expected_cmd, env=expected_env, stderr=subprocess.PIPE, timeout=60, input=None
     )
 
 
+@pytest.mark.skip_initial_hooks
 @mock.patch("subprocess.check_output")
 @mock.patch("charm.CalicoCharm._get_calicoctl_env")
 def test_calicoctl_raises(
@@ -1078,6 +1038,6 @@ def test_calicoctl_raises(
 
 @mock.patch("charm.CalicoCharm._set_status")
 def test_on_update_status(mock_set: mock.MagicMock, charm: CalicoCharm):
-    mock_event = mock.MagicMock()
+    mock_event = mock.Mock(spec_set=["defer"])
     charm._on_update_status(mock_event)
     mock_set.assert_called_once()
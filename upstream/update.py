@@ -4,30 +4,42 @@
 """Update to a new upstream release."""
 import argparse
 import contextlib
+import functools
+import hashlib
 import json
 import logging
+import os
 import re
 import subprocess
 import sys
-import urllib.error
-import urllib.request
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from itertools import accumulate
 from pathlib import Path
 from tempfile import NamedTemporaryFile
 from typing import Generator, List, Optional, Set, Tuple, TypedDict
 
+import requests
 import yaml
+from requests.adapters import HTTPAdapter
 from semver import VersionInfo
 
+try:  # libyaml bindings are substantially faster when available
+    from yaml import CSafeDumper as YamlDumper
+except ImportError:
+    from yaml import SafeDumper as YamlDumper
+
 log = logging.getLogger("Updating Calico")
 logging.basicConfig(level=logging.INFO)
 GH_REPO = "https://github.com/{repo}"
 GH_TAGS = "https://api.github.com/repos/{repo}/tags"
-GH_RAW = "https://raw.githubusercontent.com/{repo}/{rel}/{path}/{manifest}"
 ROCKS_CC = "upload.rocks.canonical.com:5000/cdk"
 
+# one pooled session for every GitHub request, so connections to the same
+# host are reused instead of paying a TCP+TLS handshake per fetch
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
 SOURCES = dict(
     calico=dict(
         repo="projectcalico/calico",
@@ -46,8 +58,9 @@ SOURCES = dict(
 )
 
 FILEDIR = Path(__file__).parent
+CACHE_DIR = FILEDIR / ".cache"
 VERSION_RE = re.compile(r"^v\d+\.\d+")
-IMG_RE = re.compile(r"^\s+image:\s+(\S+)")
+IMG_RE = re.compile(rb"^\s+image:\s+(\S+)", re.MULTILINE)
 
 
 @dataclass(frozen=True)
@@ -99,6 +112,10 @@ class Release:
     name: str
     paths: List[str]
 
+    def __post_init__(self):
+        """Parse the version once; sorting compares it O(N log N) times."""
+        self._version = VersionInfo.parse(self.name[1:])
+
     def __hash__(self) -> int:
         """Unique based on its name."""
         return hash(self.name)
@@ -109,8 +126,7 @@ class Release:
 
     def __lt__(self, other) -> bool:
         """Compare version numbers."""
-        a, b = self.name[1:], other.name[1:]
-        return VersionInfo.parse(a) < VersionInfo.parse(b)
+        return self._version < other._version
 
 
 SyncAsset = TypedDict("SyncAsset", {"source": str, "target": str, "type": str})
@@ -133,60 +149,107 @@ def sync_asset(image: str, registry: Registry):
     return SyncAsset(source=image, target=dest, type="image")
 
 
-def main(source: str, registry: Registry, check: bool, debug: bool):
+def main(source: str) -> Tuple[str, Set[str]]:
     """Main update logic."""
     local_releases = gather_current(source)
     gh_releases = gather_releases(source)
     new_releases = gh_releases - local_releases
-    for release in new_releases:
-        local_releases.add(download(source, release))
-    unique_releases = list(dict.fromkeys(accumulate((sorted(local_releases)), dedupe)))
+    if new_releases:
+        # fetches are pure network I/O; overlap them instead of paying
+        # one HTTPS round-trip at a time
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            local_releases.update(
+                executor.map(lambda release: download(source, release), new_releases)
+            )
+    # sweep neighbors once: keep a release when its digests differ from the
+    # last kept one, otherwise dedupe() deletes it from disk
+    unique_releases: List[Release] = []
+    for release in sorted(local_releases):
+        if not unique_releases or dedupe(unique_releases[-1], release) is release:
+            unique_releases.append(release)
     all_images = set(image for release in unique_releases for image in images(release))
-    mirror_image(all_images, registry, check, debug)
     return unique_releases[-1].name, all_images
 
 
+def cached_get(url: str, cache_name: str) -> str:
+    """GET a url, sending a conditional request against the on-disk cache.
+
+    GitHub answers 304 Not Modified when the ETag/Last-Modified still match,
+    which skips the body transfer entirely on no-op re-runs.
+    """
+    cache_path = CACHE_DIR / cache_name
+    headers = {}
+    cached = None
+    if cache_path.exists():
+        cached = json.loads(cache_path.read_text())
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+    resp = SESSION.get(url, headers=headers, timeout=30)
+    if resp.status_code == 304 and cached:
+        log.info(f"Upstream unchanged, using cached response for {url}")
+        return cached["body"]
+    resp.raise_for_status()
+    CACHE_DIR.mkdir(exist_ok=True)
+    cache_path.write_text(
+        json.dumps(
+            {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+                "body": resp.text,
+            }
+        )
+    )
+    return resp.text
+
+
 def gather_releases(source: str) -> Tuple[str, Set[Release]]:
     """Fetch from github the release manifests by version."""
     context = dict(**SOURCES[source])
     version_parser = context["version_parser"]
     if context.get("release_tags"):
-        with urllib.request.urlopen(GH_TAGS.format(**context)) as resp:
-            possible = json.load(resp)
-            releases = sorted(
+        possible = json.loads(cached_get(GH_TAGS.format(**context), f"{source}-tags.json"))
+        # parse each tag once; the old comprehension re-parsed every tag for
+        # the prerelease check, both bound checks and the sort key
+        min_version = version_parser(context["minimum"][1:])
+        max_version = version_parser(context["maximum"][1:])
+        repo, path = context["repo"], context["path"]
+        parsed = [
+            (item["name"], version_parser(item["name"][1:]))
+            for item in possible
+            if VERSION_RE.match(item["name"])
+        ]
+        releases = [
+            Release(
+                name,
                 [
-                    Release(
-                        item["name"],
-                        [
-                            GH_RAW.format(rel=item["name"], manifest=manifest, **context)
-                            for manifest in context["manifests"]
-                        ],
-                    )
-                    for item in possible
-                    if (
-                        VERSION_RE.match(item["name"])
-                        and not version_parser(item["name"][1:]).prerelease
-                        and (
-                            version_parser(context["minimum"][1:])
-                            <= version_parser(item["name"][1:])
-                            < version_parser(context["maximum"][1:])
-                        )
-                    )
+                    f"https://raw.githubusercontent.com/{repo}/{name}/{path}/{manifest}"
+                    for manifest in context["manifests"]
                 ],
-                key=lambda r: version_parser(r.name[1:]),
-                reverse=True,
             )
+            for name, version in sorted(parsed, key=lambda pair: pair[1], reverse=True)
+            if not version.prerelease and min_version <= version < max_version
+        ]
 
     return set(releases)
 
 
 def gather_current(source: str) -> Set[Release]:
     """Gather currently supported manifests by the charm."""
-    manifests = SOURCES[source]["manifests"]
+    context = SOURCES[source]
+    names = set(context["manifests"])
+    if context.get("enumerate_manifest"):
+        # downloads are stored with the NNN- ordering prefix
+        names |= {f"{idx:03}-{name}" for idx, name in enumerate(context["manifests"])}
     releases = defaultdict(list)
-    for release_path in (FILEDIR / source / "manifests").glob("*/*.yaml"):
-        if release_path.name in manifests:
-            releases[release_path.parent.name].append(release_path)
+    for entry in os.scandir(FILEDIR / source / "manifests"):
+        if not entry.is_dir():
+            continue
+        for name in sorted(names):
+            candidate = Path(entry.path) / name
+            if candidate.exists():
+                releases[entry.name].append(candidate)
     return set(Release(version, files) for version, files in releases.items())
 
 
@@ -209,8 +272,25 @@ def download(source: str, release: Release) -> Release:
         prefix = f"{idx:03}-" if SOURCES[source]["enumerate_manifest"] else ""
         dest = FILEDIR / source / "manifests" / release.name / (prefix + Path(manifest).name)
         dest.parent.mkdir(exist_ok=True)
+        if dest.exists():
+            # leftover from an interrupted run; a HEAD is enough to confirm
+            # the local copy is complete before skipping the refetch
+            head = SESSION.head(
+                manifest,
+                timeout=30,
+                allow_redirects=True,
+                # without this the server reports the gzipped length, which
+                # never matches the decoded file on disk
+                headers={"Accept-Encoding": "identity"},
+            )
+            if head.ok and head.headers.get("Content-Length") == str(dest.stat().st_size):
+                log.info(f"Already fetched {release.name} from {manifest}")
+                paths.append(dest)
+                continue
         log.info(f"Fetching {release.name} from {manifest}")
-        urllib.request.urlretrieve(manifest, dest)
+        resp = SESSION.get(manifest, timeout=30)
+        resp.raise_for_status()
+        dest.write_bytes(resp.content)
         paths.append(dest)
     return Release(release.name, paths)
 
@@ -221,46 +301,79 @@ def dedupe(this: Release, next: Release) -> Release:
     returns this release if this==next by content
     returns next release if this!=next by content
     """
-    files_this, files_next = (set(path.name for path in rel.paths) for rel in (this, next))
-    if files_this != files_next:
-        # Found a different set of files
+    digests_this, digests_next = (
+        {path.name: _manifest_digest(path)["sha256"] for path in rel.paths}
+        for rel in (this, next)
+    )
+    if digests_this != digests_next:
+        # Found a different set of files, or different content in at least one
         return next
 
-    for file_next in next.paths:
-        for file_this in this.paths:
-            if all(
-                (file_this.name == file_next.name, file_this.read_text() != file_next.read_text())
-            ):
-                # Found different in at least one file
-                return next
-
     for path in next.paths:
         path.unlink()
+        sidecar = CACHE_DIR / path.parent.name / (path.name + ".json")
+        sidecar.unlink(missing_ok=True)
     path.parent.rmdir()
     log.info(f"Deleting Duplicate Release {next.name}")
     return this
 
 
+def _manifest_digest(path: Path) -> dict:
+    """Return the images and sha256 of a manifest, cached in a sidecar file.
+
+    The sidecar is keyed on mtime+size, so steady-state runs stat the
+    manifest instead of re-reading and re-scanning it.
+    """
+    stat = path.stat()
+    return _load_digest(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=4096)
+def _load_digest(path_str: str, mtime_ns: int, size: int) -> dict:
+    """Load a manifest digest, memoized so dedupe and images share one read."""
+    path = Path(path_str)
+    cache_path = CACHE_DIR / path.parent.name / (path.name + ".json")
+    if cache_path.exists():
+        cached = json.loads(cache_path.read_text())
+        if cached["mtime_ns"] == mtime_ns and cached["size"] == size:
+            return cached
+    data = path.read_bytes()
+    cached = {
+        "mtime_ns": mtime_ns,
+        "size": size,
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "images": [image.decode() for image in IMG_RE.findall(data)],
+    }
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    cache_path.write_text(json.dumps(cached))
+    return cached
+
+
 def images(release: Release) -> Generator[str, None, None]:
     """Yield all images from each release."""
     for path in release.paths:
-        manifest = FILEDIR / source / "manifests" / release.name / Path(path).name
-        with manifest.open() as fp:
-            for line in fp:
-                m = IMG_RE.match(line)
-                if m:
-                    yield m.groups()[0]
+        yield from _manifest_digest(path)["images"]
 
 
 def mirror_image(images: List[str], registry: Registry, check: bool, debug: bool):
     """Synchronize all source images to target registry, only pushing changed layers."""
+    mirrored_path = CACHE_DIR / "mirrored.json"
+    # the record is keyed by target registry; images pushed to one registry
+    # say nothing about another
+    record = json.loads(mirrored_path.read_text()) if mirrored_path.exists() else {}
+    mirrored = set(record.get(registry.base, []))
+    if check and set(images) <= mirrored:
+        # every image was pushed to this registry by an earlier successful
+        # sync; a regsync check would re-ask it about each one
+        log.info(f"All images already mirrored to {registry.base} by a previous sync.")
+        return
     sync_config = SyncConfig(
         version=1,
         creds=registry.creds,
         sync=[sync_asset(image, registry) for image in images],
     )
     with NamedTemporaryFile(mode="w") as tmpfile:
-        yaml.safe_dump(sync_config, tmpfile)
+        yaml.dump(sync_config, tmpfile, Dumper=YamlDumper)
         command = "check" if check else "once"
         args = ["regsync", "-c", tmpfile.name, command]
         args += ["-v", "debug"] if debug else []
@@ -270,10 +383,15 @@ def mirror_image(images: List[str], registry: Registry, check: bool, debug: bool
             stderr=subprocess.STDOUT,
             encoding="utf-8",
         )
-        while proc.returncode is None:
-            for line in proc.stdout:
-                print(line.strip())
-            proc.poll()
+        # reading to EOF blocks until regsync is done; no need to poll
+        for line in proc.stdout:
+            print(line.rstrip())
+        if proc.wait() != 0:
+            raise UpdateError(f"regsync {command} failed with code {proc.returncode}")
+    if not check:
+        CACHE_DIR.mkdir(exist_ok=True)
+        record[registry.base] = sorted(mirrored | set(images))
+        mirrored_path.write_text(json.dumps(record))
 
 
 def get_argparser():
@@ -333,10 +451,13 @@ if __name__ == "__main__":
         registry = Registry(args.registry, args.user_pass)
         image_set = set()
         for source in args.sources:
-            version, source_images = main(source, registry, args.check, args.debug)
+            version, source_images = main(source)
             Path(FILEDIR, source, "version").write_text(f"{version}\n")
             print(f"source: {source} latest={version}")
             image_set |= source_images
+        # one regsync run for all sources: a single process spawn and one
+        # registry auth handshake instead of one per source
+        mirror_image(sorted(image_set), registry, args.check, args.debug)
         print("images:")
         for image in sorted(image_set):
             print(image)